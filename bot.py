@@ -1,6 +1,12 @@
+from __future__ import annotations
+
 import os
-import requests
+import time
+import asyncio
+import aiohttp
+import orjson
 import discord
+from functools import lru_cache
 from discord.ext import commands
 from discord import ui
 from dotenv import load_dotenv
@@ -10,15 +16,37 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 ODDS_API_KEY = os.getenv("ODDS_API_KEY")
 
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class OddsBot(commands.Bot):
+    """Bot that owns the pooled HTTP session and Odds API limiter for its lifetime."""
+
+    http_session: aiohttp.ClientSession
+    odds_limiter: OddsLimiter
+
+    async def setup_hook(self):
+        # Built here so its asyncio primitives bind to the running loop
+        self.odds_limiter = OddsLimiter()
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=64,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            ),
+        )
+
+    async def close(self):
+        session = getattr(self, "http_session", None)
+        if session is not None and not session.closed:
+            await session.close()
+        await super().close()
+
+bot = OddsBot(command_prefix="!", intents=intents)
 
 # ---------- Helpers ----------
+@lru_cache(maxsize=4096)
 def decimal_to_american(decimal_odds: float) -> str:
     """Convert decimal odds to American (+/-) format."""
-    try:
-        decimal_odds = float(decimal_odds)
-    except Exception:
-        return str(decimal_odds)
     if decimal_odds >= 2.0:
         american = (decimal_odds - 1) * 100
         return f"+{int(round(american))}"
@@ -26,9 +54,98 @@ def decimal_to_american(decimal_odds: float) -> str:
         american = -100 / (decimal_odds - 1)
         return f"{int(round(american))}"
 
+def build_markets_index(game: dict) -> dict[str, list[dict]]:
+    """Group every bookmaker outcome of a game by market key in one pass."""
+    markets_index = {"h2h": [], "spreads": [], "totals": []}
+    for book in game.get("bookmakers", []):
+        title = book.get("title", "?")
+        markets_by_key = {mk.get("key"): mk for mk in book.get("markets", [])}
+        for key, bucket in markets_index.items():
+            mk = markets_by_key.get(key)
+            if mk is None:
+                continue
+            for outcome in mk.get("outcomes", []):
+                price = outcome.get("price")
+                pt = outcome.get("point")
+                try:
+                    if isinstance(price, (int, float)):
+                        american = decimal_to_american(float(price))
+                    else:
+                        american = str(price)
+                    if pt is None or key == "h2h":
+                        pt_str = ""
+                    elif key == "spreads":
+                        pt_str = f"{pt:+g}"
+                    else:
+                        pt_str = f"{pt:g}"
+                except (ArithmeticError, TypeError, ValueError):
+                    # Skip a malformed outcome rather than lose the whole game
+                    continue
+                bucket.append({
+                    "book": title,
+                    "name": outcome.get("name"),
+                    "price_dec": price,
+                    "american": american,
+                    "point": pt,
+                    "pt_str": pt_str,
+                })
+    # Best price first within each team, teams kept in API order, so grouping
+    # in MarketDropdown needs no sorting; non-numeric prices sort last
+    for lines in markets_index.values():
+        first_seen = {}
+        for e in lines:
+            first_seen.setdefault(e["name"], len(first_seen))
+        lines.sort(key=lambda e: (
+            first_seen[e["name"]],
+            -e["price_dec"] if isinstance(e["price_dec"], (int, float)) else 0,
+        ))
+    return markets_index
+
 def market_label(key: str) -> str:
     return {"h2h": "Moneyline", "spreads": "Spread", "totals": "Totals"}.get(key, key)
 
+# Discord rejects messages over 2000 chars; leave some headroom
+MESSAGE_CHUNK_LIMIT = 1900
+
+def chunk_message(parts: list[str], limit: int = MESSAGE_CHUNK_LIMIT) -> list[str]:
+    r"""Split message lines into chunks under the limit.
+
+    parts[0] is the header and is repeated on every chunk; a section heading
+    (a line starting with a blank line) is always kept with its first line and
+    is repeated when its lines spill over.
+
+    >>> chunk_message(["H", "\n**A**:", "a1", "a2"], limit=12)
+    ['H\n\n**A**:\na1', 'H\n\n**A**:\na2']
+    >>> chunk_message(["H", "\n**A**:", "a1", "\n**B**:", "b1"], limit=20)
+    ['H\n\n**A**:\na1', 'H\n\n**B**:\nb1']
+    """
+    header, lines = parts[0], parts[1:]
+    chunks = []
+    cur, size = [header], len(header)
+    has_body = False  # only flush once cur holds a non-heading line
+    section = None
+    for i, line in enumerate(lines):
+        is_heading = line.startswith("\n")
+        needed = 1 + len(line)
+        if is_heading and i + 1 < len(lines) and not lines[i + 1].startswith("\n"):
+            # Don't leave a heading stranded at the bottom of a chunk
+            needed += 1 + len(lines[i + 1])
+        if size + needed > limit and has_body:
+            chunks.append("\n".join(cur))
+            cur, size = [header], len(header)
+            if section and not is_heading:
+                cur.append(section)
+                size += 1 + len(section)
+            has_body = False
+        if is_heading:
+            section = line
+        else:
+            has_body = True
+        cur.append(line)
+        size += 1 + len(line)
+    chunks.append("\n".join(cur))
+    return chunks
+
 # Main US leagues (no MLS)
 LEAGUES = {
     "🏈 NFL": "americanfootball_nfl",
@@ -42,16 +159,142 @@ LEAGUES = {
 
 ODDS_ENDPOINT = "https://api.the-odds-api.com/v4/sports/{sport_key}/odds/"
 
+# ---------- Odds API rate limiting ----------
+class OddsLimiter:
+    """Cap concurrent Odds API calls and back off based on quota headers."""
+
+    def __init__(self, concurrency: int = 8, low_quota: int = 20, cooldown: float = 2.0):
+        self.sem = asyncio.Semaphore(concurrency)
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.low_quota = low_quota
+        self.cooldown = cooldown
+        self._resume_at = 0.0
+        self._reopen: asyncio.TimerHandle | None = None
+        self._pause_until = 0.0
+
+    async def __aenter__(self):
+        # Pace outgoing requests before they spend quota, not after
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.gate.wait()
+            delay = self._pause_until - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self.sem.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+    def _open_gate(self):
+        self._reopen = None
+        self.gate.set()
+
+    def observe(self, resp: aiohttp.ClientResponse):
+        """Adjust pacing from a response's status and quota headers."""
+        if resp.status == 429:
+            try:
+                retry_after = float(resp.headers.get("Retry-After", self.cooldown))
+            except ValueError:
+                retry_after = self.cooldown
+            # Hold new callers at the gate until the latest window passes;
+            # a shorter Retry-After must not reopen it early
+            loop = asyncio.get_running_loop()
+            self._resume_at = max(self._resume_at, loop.time() + retry_after)
+            self.gate.clear()
+            if self._reopen is not None:
+                self._reopen.cancel()
+            self._reopen = loop.call_at(self._resume_at, self._open_gate)
+            return
+
+        remaining = resp.headers.get("x-requests-remaining")
+        try:
+            remaining = float(remaining) if remaining is not None else None
+        except ValueError:
+            remaining = None
+        if remaining is not None and remaining < self.low_quota:
+            print(f"Odds API quota low: {remaining:g} left "
+                  f"({resp.headers.get('x-requests-used', '?')} used)")
+            loop = asyncio.get_running_loop()
+            self._pause_until = max(self._pause_until, loop.time() + self.cooldown)
+
+# ---------- Odds cache ----------
+# sport_key -> (fetched_at, etag, last_modified, games); entries older than
+# the TTL are revalidated with a conditional request
+ODDS_CACHE_TTL = 30
+_odds_cache: dict[str, tuple[float, str | None, str | None, list]] = {}
+_odds_locks: dict[str, asyncio.Lock] = {}
+
+async def fetch_odds(sport_key: str) -> list:
+    """Return odds for a league, serving from cache while fresh."""
+    cached = _odds_cache.get(sport_key)
+    if cached and time.monotonic() - cached[0] < ODDS_CACHE_TTL:
+        return cached[3]
+
+    lock = _odds_locks.setdefault(sport_key, asyncio.Lock())
+    async with lock:
+        # Another caller may have refreshed the entry while we waited
+        cached = _odds_cache.get(sport_key)
+        if cached and time.monotonic() - cached[0] < ODDS_CACHE_TTL:
+            return cached[3]
+
+        params = {
+            "apiKey": ODDS_API_KEY,
+            "regions": "us",
+            "markets": "h2h,spreads,totals",
+            "oddsFormat": "decimal",
+        }
+        headers = {}
+        if cached:
+            _, etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        try:
+            async with bot.odds_limiter, bot.http_session.get(
+                ODDS_ENDPOINT.format(sport_key=sport_key),
+                params=params,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=12),
+            ) as resp:
+                bot.odds_limiter.observe(resp)
+                resp.raise_for_status()
+                if resp.status == 304 and cached:
+                    # Unchanged upstream: keep the cached body, skip decoding
+                    _odds_cache[sport_key] = (time.monotonic(), *cached[1:])
+                    return cached[3]
+                games = orjson.loads(await resp.read())
+                etag = resp.headers.get("ETag")
+                last_modified = resp.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError):
+            # Serve stale data rather than failing the interaction
+            if cached:
+                return cached[3]
+            raise
+
+        _odds_cache[sport_key] = (time.monotonic(), etag, last_modified, games)
+        return games
+
 # ---------- UI Components ----------
+# Static dropdown options, built once at import
+_LEAGUE_OPTIONS = [
+    discord.SelectOption(label=label, value=code)
+    for label, code in LEAGUES.items()
+]
+_MARKET_OPTIONS = [
+    discord.SelectOption(label="Moneyline", value="h2h"),
+    discord.SelectOption(label="Spread", value="spreads"),
+    discord.SelectOption(label="Totals", value="totals"),
+]
+
 class LeagueDropdown(ui.Select):
     def __init__(self):
-        options = [
-            discord.SelectOption(label=label, value=code)
-            for label, code in LEAGUES.items()
-        ]
         super().__init__(
             placeholder="Select a League",
-            options=options,
+            options=_LEAGUE_OPTIONS,
             min_values=1,
             max_values=1,
         )
@@ -61,21 +304,16 @@ class LeagueDropdown(ui.Select):
         await interaction.response.defer(thinking=True, ephemeral=True)
 
         league_code = self.values[0]
-        params = {
-            "apiKey": ODDS_API_KEY,
-            "regions": "us",
-            "markets": "h2h,spreads,totals",
-            "oddsFormat": "decimal",
-        }
         try:
-            resp = requests.get(
-                ODDS_ENDPOINT.format(sport_key=league_code),
-                params=params,
-                timeout=12,
-            )
-            resp.raise_for_status()
-            games = resp.json()
+            games = await fetch_odds(league_code)
+        except aiohttp.ClientResponseError as e:
+            if e.status == 429:
+                await interaction.followup.send("❌ Odds API rate limit hit, try again shortly.", ephemeral=True)
+            else:
+                await interaction.followup.send(f"❌ API error: {e}", ephemeral=True)
+            return
         except Exception as e:
+            # Always answer the deferred interaction, whatever went wrong
             await interaction.followup.send(f"❌ API error: {e}", ephemeral=True)
             return
 
@@ -91,7 +329,15 @@ class LeagueDropdown(ui.Select):
 
 class GameDropdown(ui.Select):
     def __init__(self, games):
-        self.games = games
+        # Keep only what the market step needs, keyed by id for O(1) lookup
+        self.games_by_id = {
+            g["id"]: {
+                "away_team": g.get("away_team", "Away"),
+                "home_team": g.get("home_team", "Home"),
+                "bookmakers": g.get("bookmakers", []),
+            }
+            for g in games[:25]
+        }
         options = []
         for g in games[:25]:
             label = f"{g['away_team']} @ {g['home_team']}"
@@ -104,88 +350,69 @@ class GameDropdown(ui.Select):
         )
 
     async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer(thinking=True, ephemeral=True)
+
         game_id = self.values[0]
-        game = next((g for g in self.games if g["id"] == game_id), None)
+        game = self.games_by_id.get(game_id)
         if not game:
-            await interaction.response.send_message("❌ Game not found.", ephemeral=True)
+            await interaction.followup.send("❌ Game not found.", ephemeral=True)
+            return
+
+        try:
+            markets_index = build_markets_index(game)
+        except Exception as e:
+            # Always answer the deferred interaction, whatever went wrong
+            await interaction.followup.send(f"❌ Couldn't read odds for that game: {e}", ephemeral=True)
             return
 
         view = ui.View(timeout=120)
-        view.add_item(MarketDropdown(game))
-        await interaction.response.send_message("Select a market:", view=view, ephemeral=True)
+        view.add_item(MarketDropdown(game, markets_index))
+        await interaction.followup.send("Select a market:", view=view, ephemeral=True)
 
 class MarketDropdown(ui.Select):
-    def __init__(self, game):
+    def __init__(self, game, markets_index):
         self.game = game
-        options = [
-            discord.SelectOption(label="Moneyline", value="h2h"),
-            discord.SelectOption(label="Spread", value="spreads"),
-            discord.SelectOption(label="Totals", value="totals"),
-        ]
+        self.markets_index = markets_index
         super().__init__(
             placeholder="Select a Market",
-            options=options,
+            options=_MARKET_OPTIONS,
             min_values=1,
             max_values=1,
         )
 
     async def callback(self, interaction: discord.Interaction):
-        mkey = self.values[0]
-        bookmakers = self.game.get("bookmakers", [])
-        lines = []
+        await interaction.response.defer(thinking=True, ephemeral=True)
 
-        # Collect outcomes for selected market
-        for book in bookmakers:
-            mk = next((m for m in book.get("markets", []) if m.get("key") == mkey), None)
-            if not mk:
-                continue
-            for outcome in mk.get("outcomes", []):
-                lines.append({
-                    "book": book.get("title", "?"),
-                    "name": outcome.get("name"),
-                    "price_dec": outcome.get("price"),
-                    "american": decimal_to_american(outcome.get("price")),
-                    "point": outcome.get("point"),
-                })
+        mkey = self.values[0]
+        lines = self.markets_index[mkey]
 
         if not lines:
-            await interaction.response.send_message("❌ No odds found for that market.", ephemeral=True)
+            await interaction.followup.send("❌ No odds found for that market.", ephemeral=True)
             return
 
-        away = self.game.get("away_team", "Away")
-        home = self.game.get("home_team", "Home")
+        away = self.game["away_team"]
+        home = self.game["home_team"]
         header = f"📊 {away} @ {home} — {market_label(mkey)}"
 
         # Format by market
+        parts: list[str] = [header]
         if mkey == "h2h":
             by_team = {}
             for e in lines:
                 by_team.setdefault(e["name"], []).append(e)
 
-            msg = [header]
             for team, lst in by_team.items():
-                lst_sorted = sorted(lst, key=lambda x: (x["price_dec"] or 0), reverse=True)
-                section = [f"\n**{team}** (high → low):"]
-                for e in lst_sorted:
-                    section.append(f"{e['book']}: {e['american']}")
-                msg.append("\n".join(section))
-            text = "\n".join(msg)
+                parts.append(f"\n**{team}** (high → low):")
+                parts.extend(f"{e['book']}: {e['american']}" for e in lst)
 
         elif mkey == "spreads":
             by_team = {}
             for e in lines:
                 by_team.setdefault(e["name"], []).append(e)
 
-            msg = [header]
             for team, lst in by_team.items():
-                lst_sorted = sorted(lst, key=lambda x: (x["price_dec"] or 0), reverse=True)
-                section = [f"\n**{team}** (spread high → low):"]
-                for e in lst_sorted:
-                    pt = e["point"]
-                    pt_str = f"{pt:+g}" if pt is not None else ""
-                    section.append(f"{e['book']}: {pt_str} {e['american']}")
-                msg.append("\n".join(section))
-            text = "\n".join(msg)
+                parts.append(f"\n**{team}** (spread high → low):")
+                parts.extend(f"{e['book']}: {e['pt_str']} {e['american']}" for e in lst)
 
         else:  # totals
             by_kind = {"Over": [], "Under": []}
@@ -193,21 +420,19 @@ class MarketDropdown(ui.Select):
                 name = e["name"]
                 by_kind.setdefault(name, []).append(e)
 
-            msg = [header]
             for kind in ("Over", "Under"):
-                lst = by_kind.get(kind, [])
+                lst = by_kind[kind]
                 if not lst:
                     continue
-                lst_sorted = sorted(lst, key=lambda x: (x["price_dec"] or 0), reverse=True)
-                section = [f"\n**{kind}** (high → low):"]
-                for e in lst_sorted:
-                    pt = e["point"]
-                    pt_str = f"{pt:g}" if pt is not None else ""
-                    section.append(f"{e['book']}: {pt_str} {e['american']}")
-                msg.append("\n".join(section))
-            text = "\n".join(msg)
+                parts.append(f"\n**{kind}** (high → low):")
+                parts.extend(f"{e['book']}: {e['pt_str']} {e['american']}" for e in lst)
 
-        await interaction.response.send_message(text, ephemeral=True)
+        text = "\n".join(parts)
+        if len(text) <= MESSAGE_CHUNK_LIMIT:
+            await interaction.followup.send(text, ephemeral=True)
+            return
+        for chunk in chunk_message(parts):
+            await interaction.followup.send(chunk, ephemeral=True)
 
 # ---------- Slash Command ----------
 @bot.tree.command(name="odds", description="League → Game → Market dropdowns (American odds)")
@@ -217,6 +442,8 @@ async def odds_cmd(interaction: discord.Interaction):
     await interaction.response.send_message("Select a league:", view=view, ephemeral=True)
 
 # ---------- Auto-sync to every guild the bot is in ----------
+GUILD_SYNC_CONCURRENCY = 8
+
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user}")
@@ -227,12 +454,17 @@ async def on_ready():
     except Exception as e:
         print(f"Global sync error: {e}")
     # Instant sync in each guild where the bot is already a member
-    for g in bot.guilds:
-        try:
-            synced = await bot.tree.sync(guild=discord.Object(id=g.id))
-            print(f"🔁 Synced {len(synced)} command(s) in {g.name} ({g.id})")
-        except Exception as e:
-            print(f"Guild sync error for {g.id}: {e}")
+    sem = asyncio.Semaphore(GUILD_SYNC_CONCURRENCY)
+
+    async def _sync_guild(g):
+        async with sem:
+            try:
+                synced = await bot.tree.sync(guild=discord.Object(id=g.id))
+                print(f"🔁 Synced {len(synced)} command(s) in {g.name} ({g.id})")
+            except Exception as e:
+                print(f"Guild sync error for {g.id}: {e}")
 
-bot.run(DISCORD_TOKEN)
+    await asyncio.gather(*(_sync_guild(g) for g in bot.guilds), return_exceptions=True)
 
+if __name__ == "__main__":
+    bot.run(DISCORD_TOKEN)